@@ -1,3 +1,5 @@
+import concurrent.futures
+import functools
 import importlib.metadata
 import os
 import shutil
@@ -17,7 +19,15 @@ def sizeof_fmt(num, suffix="B"):
     return f"{num:.1f}Yi{suffix}"
 
 
-current_build = sp.check_output(["git", "rev-parse", "--short", "HEAD"], text=True)
+@functools.lru_cache(maxsize=1)
+def current_build_sha():
+    """
+    Return the short hash of the current commit (the `git` process is only run once).
+    """
+    return sp.check_output(["git", "rev-parse", "--short", "HEAD"], text=True)
+
+
+current_build = current_build_sha()
 print(f"Current build: {current_build}")
 
 docs = Path(__file__).parent / "docs"
@@ -28,21 +38,32 @@ latest_build_folder = docs / "latest-build"
 latest_build_folder.mkdir(exist_ok=True)
 print(f"Latest build folder: {latest_build_folder}")
 
-latest_build_text = """\
-File | Size
----- | ----
-"""
+latest_build_lines = ["File | Size\n", "---- | ----\n"]
 
 version = importlib.metadata.version("songs-dl")
 
-for file in (Path(__file__).parent / "dist").iterdir():
-    print(f"Copying {file.name} to latest-build")
-    file = Path(shutil.copy(file, latest_build_folder))
+
+def _copy_one(entry: os.DirEntry):
+    """
+    Copy a built file into the latest build folder and return its new name and its size.
+    """
+    print(f"Copying {entry.name} to latest-build")
+    file = latest_build_folder / entry.name
+    shutil.copy(entry.path, file)
     if f"-{version}" in file.name:
         file = file.rename(file.parent / file.name.replace(f"-{version}", ""))
-    fname = file.name
-    size_formatted = sizeof_fmt(os.path.getsize(file))
-    latest_build_text += f"[{fname}](latest-build/{fname}) | {size_formatted}\n"
+    # the size is already known from the directory listing
+    return file.name, entry.stat().st_size
+
+
+with os.scandir(Path(__file__).parent / "dist") as it:
+    dist_entries = list(it)
+with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) * 2)) as executor:
+    results = list(executor.map(_copy_one, dist_entries))
+
+for fname, size in sorted(results):
+    size_formatted = sizeof_fmt(size)
+    latest_build_lines.append(f"[{fname}](latest-build/{fname}) | {size_formatted}\n")
 
 print("Writing .latest-build.md")
-(docs / ".latest-build.md").write_text(latest_build_text, encoding="utf-8")
+(docs / ".latest-build.md").write_text("".join(latest_build_lines), encoding="utf-8")
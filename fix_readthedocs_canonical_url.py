@@ -1,12 +1,23 @@
 import os
-import re
 from pathlib import Path
 
 url = os.getenv("READTHEDOCS_CANONICAL_URL")
 mkdocs_yml = Path("mkdocs.yml")
-data = mkdocs_yml.read_text("utf-8")
+data = mkdocs_yml.read_bytes()
 
 print(f"Replacing site_url by {url}")
-data = re.sub(r"(?m)^site_url: .*$", f"site_url: {url}", data)
+# only the site_url line is rewritten, the rest of the file is kept as is
+PREFIX = b"site_url: "
+if data.startswith(PREFIX):
+    start = 0
+else:
+    start = data.find(b"\n" + PREFIX)
+    if start != -1:
+        start += 1
+if start != -1:
+    end = data.find(b"\n", start)
+    if end == -1:
+        end = len(data)
+    data = data[:start] + PREFIX + str(url).encode("utf-8") + data[end:]
 
-mkdocs_yml.write_text(data, "utf-8")
+mkdocs_yml.write_bytes(data)
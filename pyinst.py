@@ -1,10 +1,51 @@
+import functools
+import hashlib
+import importlib.util
+import json
+import os
 import sys
 from pathlib import Path
 
 from PyInstaller.__main__ import run
-from yt_dlp.extractor import gen_extractor_classes
+from yt_dlp.version import __version__ as yt_dlp_version
 
 BASE_PATH = Path(__file__).parent
+EXTRACTORS_CACHE = Path.home() / ".cache/songs-dl/excl.json"
+
+
+def get_extractors_key():
+    """
+    Return a key that changes when the `yt_dlp` extractors change.
+    """
+    spec = importlib.util.find_spec("yt_dlp.extractor")
+    mtime = os.stat(spec.origin).st_mtime_ns if spec and spec.origin else 0
+    return hashlib.sha256(f"{yt_dlp_version}:{mtime}".encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
+def get_extractor_modules():
+    """
+    Return the names of all the `yt_dlp` extractor modules
+    (cached on disk because importing all the extractors is slow).
+    """
+    key = get_extractors_key()
+    try:
+        cache = json.loads(EXTRACTORS_CACHE.read_text("utf-8"))
+        if cache.get("key") == key:
+            return frozenset(cache["modules"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    from yt_dlp.extractor import gen_extractor_classes
+
+    modules = frozenset(extr._module for extr in gen_extractor_classes())
+    try:
+        EXTRACTORS_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        EXTRACTORS_CACHE.write_text(json.dumps({"key": key, "modules": sorted(modules)}), "utf-8")
+    except OSError:
+        pass
+    return modules
+
 
 exclusions = [
     "cffi",  # imported by Crypto
@@ -15,12 +56,9 @@ exclusions = [
     "numpy",  # same thing
     "pandas",  # same thing
     "statistics",  # imported by random
-    *(extr._module for extr in gen_extractor_classes() if "youtube" not in extr._module),
+    *sorted(module for module in get_extractor_modules() if "youtube" not in module),
 ]
-exclusions_args = []
-for excl in exclusions:
-    exclusions_args.append("--exclude-module")
-    exclusions_args.append(excl)
+exclusions_args = [arg for excl in exclusions for arg in ("--exclude-module", excl)]
 
 system_suffix = "windows" if sys.platform == "win32" else "macos" if sys.platform == "darwin" else "linux"
 
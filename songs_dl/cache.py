@@ -0,0 +1,157 @@
+"""
+Disk cache for the provider requests.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Iterable
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .utils import session
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = Path.home() / ".cache" / "songs-dl" / "requests.sqlite"
+
+# default expiration of the cached responses (in seconds)
+DEFAULT_EXPIRE = 24 * 60 * 60
+
+# version of the database schema (the cache is cleared when it changes)
+SCHEMA_VERSION = 1
+
+# ignore the fresh cached responses (the new responses are still saved
+# and the old ones are still used if the requests fail)
+REFRESH = False
+
+_CONNECTION: sqlite3.Connection | None = None
+_lock = Lock()
+
+
+def _get_connection():
+    """
+    Return the connection to the cache database (create it if needed).
+    """
+    global _CONNECTION
+    if _CONNECTION is None:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _CONNECTION = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _CONNECTION.execute("PRAGMA journal_mode = WAL")
+        _CONNECTION.execute("PRAGMA synchronous = NORMAL")
+        if _CONNECTION.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # the old responses are not compressed
+            _CONNECTION.execute("DROP TABLE IF EXISTS responses")
+            _CONNECTION.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        _CONNECTION.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                expires REAL,
+                url TEXT,
+                status INTEGER,
+                headers TEXT,
+                content BLOB
+            )
+            """)
+    return _CONNECTION
+
+
+def get_key(url: str, params: dict[str, Any] | None = None, ignored_params: Iterable[str] = ()):
+    """
+    Return the cache key for a request.
+    """
+    params = sorted((key, str(value)) for key, value in (params or {}).items() if key not in ignored_params)
+    return hashlib.sha256(json.dumps([url, params]).encode("utf-8")).hexdigest()
+
+
+def _make_response(url: str, status: int, headers: str, content: bytes):
+    """
+    Rebuild a `requests.Response` from the cached data.
+    """
+    resp = requests.Response()
+    resp.url = url
+    resp.status_code = status
+    resp.headers = CaseInsensitiveDict(json.loads(headers))
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp._content = zlib.decompress(content)
+    resp._content_consumed = True
+    return resp
+
+
+def cached_get(
+    url: str,
+    params: dict[str, Any] | None = None,
+    *,
+    expire: float = DEFAULT_EXPIRE,
+    ignored_params: Iterable[str] = (),
+    check: Callable[[requests.Response], bool] | None = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    Send a GET request with the shared session or return the cached response if it's still valid.
+
+    The cache key only uses the URL and the `params` that are not in `ignored_params`
+    (the headers and the other arguments are ignored).
+    If `check` is given, the response is only cached if `check(response)` is true.
+    If `REFRESH` is true, the request is always sent (but the response is still cached).
+    If the request fails or the response is invalid, the cached response is returned even if it has expired.
+    """
+    key = get_key(url, params, ignored_params)
+
+    try:
+        with _lock:
+            row = (
+                _get_connection()
+                .execute("SELECT expires, url, status, headers, content FROM responses WHERE key = ?", (key,))
+                .fetchone()
+            )
+    except (OSError, sqlite3.Error) as err:
+        logger.debug("Can't read the cache: %s", err)
+        row = None
+
+    if row and not REFRESH and row[0] > time.time():
+        logger.debug("Using the cached response for %s", url)
+        return _make_response(*row[1:])
+
+    try:
+        resp = session.get(url, params=params, **kwargs)
+    except requests.RequestException as err:
+        if not row:
+            raise
+        # use the expired response if the request fails
+        logger.debug("Using the stale cached response for %s (%s)", url, err)
+        return _make_response(*row[1:])
+
+    valid = resp.ok and (check is None or check(resp))
+    if not valid and row:
+        # the cached response is valid (it has been checked before being saved)
+        logger.debug("Using the stale cached response for %s (invalid response, HTTP %d)", url, resp.status_code)
+        return _make_response(*row[1:])
+
+    if valid:
+        try:
+            with _lock:
+                connection = _get_connection()
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        time.time() + expire,
+                        resp.url,
+                        resp.status_code,
+                        json.dumps(dict(resp.headers)),
+                        zlib.compress(resp.content),
+                    ),
+                )
+                connection.commit()
+        except (OSError, sqlite3.Error) as err:
+            logger.debug("Can't write to the cache: %s", err)
+
+    return resp
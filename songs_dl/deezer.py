@@ -1,17 +1,97 @@
+import concurrent.futures
 import datetime as dt
+import functools
 import json
 import logging
 import re
+from operator import attrgetter
 from pprint import pformat
-from threading import Lock
+from threading import Lock, Semaphore
 from typing import Any
 
 import requests
 
-from .utils import Picture, PictureProvider, Song, format_query, get, locked
+from .cache import cached_get
+from .utils import Picture, PictureProvider, Song, cached_results, format_query, get, json_loads
 
 logger = logging.getLogger(__name__)
-deezer_lock = Lock()
+# limit the number of simultaneous requests to Deezer
+deezer_semaphore = Semaphore(4)
+# threads that download the song pages in the background (created when needed)
+_PREFETCH_POOL: concurrent.futures.ThreadPoolExecutor | None = None
+_prefetch_pool_lock = Lock()
+
+_APP_STATE_START = b"<script>window.__DZR_APP_STATE__"
+_APP_STATE_END = b"</script>"
+# square picture size in the file name, e.g. .../1000x1000-000000-80-0-0.jpg
+_COVER_SIZE_RE = re.compile(r"/(\d+)x\1[^/]*$")
+# size of the standard Deezer covers
+_COVER_SIZES = {
+    "small": 56,
+    "medium": 250,
+    "big": 500,
+    "xl": 1000,
+}
+
+
+def get_prefetch_pool():
+    """
+    Return the thread pool used to download the song pages in the background (create it if needed).
+    """
+    global _PREFETCH_POOL
+    with _prefetch_pool_lock:
+        if _PREFETCH_POOL is None:
+            _PREFETCH_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="deezer")
+        return _PREFETCH_POOL
+
+
+def _log_prefetch_error(future: concurrent.futures.Future):
+    """
+    Log the error of a song page download that was done in the background.
+    """
+    if not future.cancelled() and (err := future.exception()):
+        logger.error("Error when downloading a Deezer song page in the background", exc_info=err)
+
+
+def extract_app_state(page: bytes):
+    """
+    Return the raw `__DZR_APP_STATE__` JSON data in a Deezer song page or `None` if it's not found.
+    """
+    start = page.find(_APP_STATE_START)
+    if start == -1:
+        return None
+    start = page.find(b"=", start + len(_APP_STATE_START))
+    end = page.find(_APP_STATE_END, start)
+    if start == -1 or end == -1:
+        return None
+    return page[start + 1 : end].strip().removesuffix(b";")
+
+
+def is_valid_search_response(resp: requests.Response):
+    """
+    Check if a Deezer search response contains results (to avoid caching errors).
+    """
+    try:
+        data = json_loads(resp.content)
+    except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+        return False
+    return isinstance(data, dict) and "error" not in data and isinstance(data.get("data"), list)
+
+
+def is_valid_song_page(resp: requests.Response):
+    """
+    Check if a Deezer song page contains the song data (to avoid caching errors).
+    """
+    return extract_app_state(resp.content) is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def get_size_from_url(url: str):
+    """
+    Return the size of a Deezer cover with its URL or `None` if it's not found.
+    """
+    match = _COVER_SIZE_RE.search(url)
+    return int(match.group(1)) if match else None
 
 
 class DeezerPictureProvider(PictureProvider):
@@ -23,30 +103,13 @@ class DeezerPictureProvider(PictureProvider):
         # TODO add debug information
         pictures: list[Picture] = []
 
-        def get_size_from_url(url: str):
-            _, basename = url.rsplit("/", 1)
-            size, other = basename.split("x", 1)
-            try:
-                size = int(size)
-            except ValueError:
-                return None
-            if not other.startswith(str(size)):
-                return None
-            return size
-
         for key, value in get(result, "album", dict[str, str]).items():
-            if key.startswith("cover_"):
-                size = get_size_from_url(value)
-                if size is None:
-                    size = {
-                        "small": 56,
-                        "medium": 250,
-                        "big": 500,
-                        "xl": 1000,
-                    }.get(key.removeprefix("cover_"))
-                if size is None:
-                    continue
-                pictures.append(Picture(value, size))
+            if not key.startswith("cover_"):
+                continue
+            size = _COVER_SIZES.get(key[6:]) or get_size_from_url(value)
+            if size is None:
+                continue
+            pictures.append(Picture(value, size))
 
         return pictures
 
@@ -60,6 +123,9 @@ class DeezerLazySong(Song):
         self.result = result
 
         self._app_state: dict[str, Any] | None = None
+        self._app_state_lock = Lock()
+        # the song page is only downloaded once, even if it fails
+        self._fetch_failed = False
 
         self.picture = DeezerPictureProvider(result)
         super().__init__(*args, **kwargs)
@@ -76,21 +142,52 @@ class DeezerLazySong(Song):
         """
         Data in the Deezer song page.
         """
-        if self._app_state is not None:
-            return self._app_state
-        self._app_state = {}
-        logger.info("Downloading song page (%s)...", self.result["link"])
-        req = locked(deezer_lock)(requests.get)(self.result["link"])  # song page
-        match = re.search(r"<script>window.__DZR_APP_STATE__ ?= ?(.*?);?</script>", req.text)
-        if not match:
-            logger.debug("JSON data not found in the song page")
-            return {}
-        try:
-            self._app_state = json.loads(match.group(1))
+        # the page may be prefetched in another thread
+        with self._app_state_lock:
+            if self._app_state is not None:
+                return self._app_state
+            if self._fetch_failed:
+                return {}
+            # an invalid song page is not cached on the disk (so it is downloaded again in the next runs)
+            logger.info("Downloading song page (%s)...", self.result["link"])
+            try:
+                with deezer_semaphore:
+                    # song page
+                    req = cached_get(self.result["link"], expire=7 * 24 * 60 * 60, check=is_valid_song_page)
+            except requests.RequestException as err:
+                logger.warning("Can't download the Deezer song page: %s", err)
+                self._fetch_failed = True
+                return {}
+            # search in the raw bytes to avoid decoding the whole page
+            data = extract_app_state(req.content)
+            if data is None:
+                logger.warning("JSON data not found in the Deezer song page")
+                self._fetch_failed = True
+                return {}
+            try:
+                app_state = json_loads(data)
+            except (json.decoder.JSONDecodeError, UnicodeDecodeError) as err:
+                logger.warning("JSON decoding error in the Deezer song page: %s", err)
+                self._fetch_failed = True
+                return {}
             logger.debug("JSON decoding OK")
-        except json.decoder.JSONDecodeError:
-            logger.debug("JSON decoding error")
-        return self._app_state
+            # only keep the data we use, the rest of the page data is big
+            self._app_state = {
+                "DATA": get(app_state, "DATA", dict[str, Any]),
+                "LYRICS": {
+                    "LYRICS_SYNC_JSON": get(app_state, ("LYRICS", "LYRICS_SYNC_JSON"), list[dict[str, int | str]]),
+                },
+            }
+            return self._app_state
+
+    @classmethod
+    def prefetch_many(cls, songs: "list[DeezerLazySong]"):
+        """
+        Start downloading the song pages of `songs` in the background.
+        """
+        pool = get_prefetch_pool()
+        for song in songs:
+            pool.submit(attrgetter("app_state"), song).add_done_callback(_log_prefetch_error)
 
     @property
     def data(self):
@@ -225,21 +322,23 @@ class DeezerLazySong(Song):
         pass
 
 
-def download_deezer(song: str, artist: str | None = None, _market: str | None = None):
+@cached_results()
+def search_deezer(song: str, artist: str | None = None):
     """
-    Fetch the Deezer search results.
+    Return the raw Deezer search results.
     """
     logger.info("Searching %s on Deezer...", format_query(song, artist))
     if artist:
         query = f"{song} {artist}"
     else:
         query = song
-    req = locked(deezer_lock)(requests.get)("https://api.deezer.com/search/track", params={"q": query})
+    with deezer_semaphore:
+        req = cached_get("https://api.deezer.com/search/track", params={"q": query}, check=is_valid_search_response)
     try:
         # decode the JSON data
-        search = req.json()
+        search = json_loads(req.content)
         logger.debug("JSON decoding OK")
-    except requests.exceptions.JSONDecodeError:
+    except (json.decoder.JSONDecodeError, UnicodeDecodeError):
         # we skip Deezer
         logger.debug("JSON decoding error")
         return []
@@ -249,11 +348,22 @@ def download_deezer(song: str, artist: str | None = None, _market: str | None =
         logger.debug("No 'data' index")
         return []  # same thing
 
+    return results
+
+
+def download_deezer(song: str, artist: str | None = None, _market: str | None = None):
+    """
+    Fetch the Deezer search results.
+    """
     ret: list[Song] = []
 
-    for result in results:
+    for result in search_deezer(song, artist):
         ret.append(DeezerLazySong(result))
 
-    logger.debug("Results:\n%s", pformat(ret))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Results:\n%s", pformat(ret))
+
+    # the page of the first result is used when ranking the other providers' results (copyright)
+    DeezerLazySong.prefetch_many(ret[:1])
 
     return ret
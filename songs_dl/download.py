@@ -0,0 +1,336 @@
+"""
+Download a song and add its ID3 tags.
+"""
+
+import concurrent.futures
+import logging
+import re
+import sys
+import time
+import traceback
+from collections import deque
+from io import BytesIO
+from itertools import islice
+from pprint import pformat
+from threading import Lock
+from typing import Callable, TypedDict
+
+import mutagen.id3
+from yt_dlp.utils import sanitize_filename
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from .deezer import download_deezer
+from .itunes import download_itunes
+from .musixmatch import download_musixmatch
+from .spotify import download_spotify
+from .utils import Picture, Song, TagsList, merge_dicts, order_results
+from .youtube import YoutubeSong, download_youtube
+from .youtube_dl import ARTIST_TEMPLATE, TITLE_TEMPLATE, download_youtube_dl
+
+logger = logging.getLogger(__name__)
+
+_MARKET_RE = re.compile(r"\bmarket:([\w-]+)\s*")
+
+# providers sorted by confidence
+BEST_PROVIDERS = ["spotify", "itunes", "musixmatch", "deezer", "youtube"]
+_PROVIDER_RANK = {provider: rank for rank, provider in enumerate(BEST_PROVIDERS)}
+
+# time to wait for the other providers when Spotify has found the song (in seconds)
+PROVIDERS_GRACE_TIMEOUT = 2.0
+# providers that are always waited for (Musixmatch is the only source of the plain lyrics)
+ALWAYS_WAITED_PROVIDERS = {"musixmatch", "youtube"}
+
+# mutagen frame classes for all the tags we set
+ID3_FRAMES = {tag_name: getattr(mutagen.id3, tag_name) for tag_name in TagsList.__annotations__}
+
+# thread pool shared by all the songs for the provider searches
+_PROVIDER_POOL: concurrent.futures.ThreadPoolExecutor | None = None
+_provider_pool_lock = Lock()
+
+# maximum size of the album art
+MAX_PICTURE_SIZE = 1200
+# number of album arts that are downloaded in the same time
+PICTURE_DOWNLOAD_WORKERS = 3
+
+
+class TagParams(TypedDict, total=False):
+    """
+    Dict with ID3 tags to be passed to `mutagen`.
+    """
+
+    encoding: int
+    text: str
+    lang: str
+
+    type: int
+    desc: str
+    mime: str
+    data: bytes
+
+
+def get_provider_pool():
+    """
+    Return the thread pool used for the provider searches (create it if needed).
+    """
+    global _PROVIDER_POOL
+    with _provider_pool_lock:
+        if _PROVIDER_POOL is None:
+            _PROVIDER_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="provider")
+        return _PROVIDER_POOL
+
+
+def get_image_mimetype(mimetype: str | None, url: str):
+    """
+    Get image MIME type with its `Content-Type` header or its file extension.
+    """
+    if mimetype and mimetype.startswith("image/") and len(mimetype) > 6:  # image/...
+        return mimetype
+    ext = url.rsplit(".", 1)[-1].replace("jpg", "jpeg")
+    if ext not in ["jpeg", "png", "gif", "webp"]:
+        ext = "jpeg"
+    return "image/" + ext
+
+
+def _get_apic_tag(pictures: list[Picture]) -> TagParams:
+    """
+    Download the biggest working picture and return the `APIC` tag parameters
+    (the picture is resized only if it's too big or not a JPEG).
+    """
+    params: TagParams = {}
+    # we try all the pictures, biggest first, downloading a few of them at the same time
+    # (the next picture is only downloaded when one of them fails)
+    candidates = iter(sorted(pictures, key=lambda e: e.size, reverse=True))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=PICTURE_DOWNLOAD_WORKERS)
+    try:
+        futures = deque(
+            (picture, executor.submit(picture.download)) for picture in islice(candidates, PICTURE_DOWNLOAD_WORKERS)
+        )
+        while futures:
+            picture, future = futures.popleft()
+            data = future.result()
+            if data is False:
+                next_picture = next(candidates, None)
+                if next_picture is not None:
+                    futures.append((next_picture, executor.submit(next_picture.download)))
+                continue
+            params["type"] = 3
+            params["desc"] = picture.url
+            if Image is not None:
+                try:
+                    # the decoded picture is freed as soon as it's encoded
+                    with Image.open(BytesIO(data)) as img:
+                        if img.format == "JPEG" and max(img.size) <= MAX_PICTURE_SIZE:
+                            # the picture can be used as is, don't decode it
+                            params["mime"] = "image/jpg"
+                            params["data"] = data
+                            break
+                        # let libjpeg decode big pictures at a reduced scale
+                        img.draft("RGB", (MAX_PICTURE_SIZE, MAX_PICTURE_SIZE))
+                        img.thumbnail((MAX_PICTURE_SIZE, MAX_PICTURE_SIZE), Image.Resampling.BILINEAR)
+                        output = BytesIO()
+                        img.save(output, format="jpeg", quality=85, optimize=True, progressive=True)
+                    params["mime"] = "image/jpg"
+                    params["data"] = output.getvalue()
+                    break
+                except OSError:
+                    pass
+            params["mime"] = get_image_mimetype(
+                mimetype=picture.req.headers.get("Content-Type") if picture.req else None, url=picture.url
+            )
+            params["data"] = data
+            break
+    finally:
+        # don't wait for the other pictures if we already have one
+        executor.shutdown(wait=False, cancel_futures=True)
+    return params
+
+
+def spotify_song_is_confirmed(results: dict[str, list[Song]]):
+    """
+    Return `True` if the first Spotify result has an ISRC, the YouTube videos are here
+    and the first Spotify result is also the best match for the results of the other providers.
+    """
+    if not results["spotify"] or not results["spotify"][0].isrc or not results["youtube"]:
+        return False
+    best_items = [songs[0] for provider, songs in results.items() if provider != "spotify" and songs]
+    if not any(song.duration for song in best_items):
+        # the durations can't be compared (e.g. only a YouTube livestream is here)
+        return False
+    ranked = order_results("spotify", best_items, results)
+    return bool(ranked) and ranked[0].isrc == results["spotify"][0].isrc
+
+
+def download_song(query: str) -> str | None:
+    """
+    Download a song with ID3 tags (title, artist, lyrics...).
+    Return the path of the song or None.
+    """
+
+    logger.info("Downloading '%s'", query)
+
+    match = _MARKET_RE.match(query)
+    if match:
+        market = match.group(1)
+        query = query[: match.start()] + query[match.end() :]
+    else:
+        market = None
+
+    song, separator, artist = query.partition("--")
+    song = song.strip()
+    artist = artist.strip() if separator else None
+
+    logger.debug("Parsed query: song = %r, artist = %r, market = %r", song, artist, market)
+
+    results: dict[str, list[Song]] = {
+        "spotify": [],
+        "itunes": [],
+        "musixmatch": [],
+        "deezer": [],
+        "youtube": [],
+    }
+    actions: dict[str, Callable[[str], list[Song]]] = {
+        "spotify": download_spotify,
+        "itunes": download_itunes,
+        "musixmatch": download_musixmatch,
+        "deezer": download_deezer,
+        "youtube": download_youtube,
+    }
+
+    executor = get_provider_pool()
+    future_to_action = {executor.submit(func, song, artist, market): action for action, func in actions.items()}
+    pending = set(future_to_action)
+    deadline = None
+    grace_over = False
+    while pending:
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        done, pending = concurrent.futures.wait(pending, timeout, concurrent.futures.FIRST_COMPLETED)
+        if not done:
+            # don't let the slowest providers delay the download
+            # (the providers that are waiting for a thread are not slow, we still wait for them)
+            dropped = {
+                future
+                for future in pending
+                if future.running() and future_to_action[future] not in ALWAYS_WAITED_PROVIDERS
+            }
+            if dropped:
+                logger.warning(
+                    "Not waiting for %s, their metadata won't be used",
+                    ", ".join(sorted(future_to_action[future] for future in dropped)),
+                )
+            pending -= dropped
+            deadline = None
+            grace_over = True
+            continue
+        for future in done:
+            provider = future_to_action[future]
+            try:
+                results[provider] = future.result()
+            except:  # noqa
+                print(f"Error when executing {provider}:", file=sys.stderr)
+                traceback.print_exc()
+            if provider == "youtube" and len(results[provider]) == 0:
+                logger.error("No videos available!")
+                for future in future_to_action:
+                    future.cancel()
+                return None
+        if not grace_over and deadline is None and spotify_song_is_confirmed(results):
+            # Spotify found the song (with its ISRC) and we have the videos,
+            # the other providers only add metadata
+            deadline = time.monotonic() + PROVIDERS_GRACE_TIMEOUT
+
+    # be sure there is at least one song in every list
+    for provider, songs in results.items():
+        if len(songs) == 0:
+            songs.append(Song.empty())
+
+    # best song of each provider, sorted by confidence
+    # (updated as soon as a provider's results are ordered)
+    best_songs = {provider: results[provider][0] for provider in sorted(results, key=_PROVIDER_RANK.__getitem__)}
+
+    # order the results
+    for provider in results:
+        if provider != "spotify":
+            results[provider] = order_results(
+                provider, [song for other, song in best_songs.items() if other != provider], results
+            )
+        if len(results[provider]) == 0:
+            if provider == "youtube":
+                logger.error("No videos available!")
+                return None
+            results[provider].append(Song.empty())
+        best_songs[provider] = results[provider][0]
+
+    best_video: YoutubeSong = results["youtube"][0]  # type: ignore
+
+    # fetch the lazy metadata (Deezer song page, Musixmatch lyrics...)
+    id3_futures = {provider: executor.submit(songs[0].to_id3) for provider, songs in results.items()}
+
+    # choose the final filename before downloading so the file doesn't need to be renamed
+    # (with the same title and artist as the tags below, the YouTube page ones are filled in by yt-dlp)
+    providers_tags = merge_dicts(
+        *(id3_futures[provider].result() for provider in ("spotify", "itunes", "musixmatch", "deezer"))
+    )
+    best_title = providers_tags.get("TIT2", [""])[0]
+    best_artist = providers_tags.get("TPE1", [""])[0]
+    outtmpl = (
+        (sanitize_filename(best_artist).replace("%", "%%") if best_artist else ARTIST_TEMPLATE)
+        + " - "
+        + (sanitize_filename(best_title).replace("%", "%%") if best_title else TITLE_TEMPLATE)
+        + ".%(ext)s"
+    )
+
+    filename, youtube_song = download_youtube_dl(
+        "https://www.youtube.com/watch?v=" + best_video.youtube_video["id"],
+        outtmpl,
+    )
+    # add the metadata from the YouTube page
+    results["youtube_dl"] = [youtube_song]
+
+    # we don't need to load the file's tags (we replace them)
+    # so there is no filename here
+    tags = mutagen.id3.ID3()
+
+    # tags (spotify -> itunes -> musixmatch -> deezer -> youtube)
+    tags_list = merge_dicts(
+        id3_futures["spotify"].result(),
+        id3_futures["itunes"].result(),
+        id3_futures["musixmatch"].result(),
+        id3_futures["deezer"].result(),
+        results["youtube_dl"][0].to_id3(),
+        id3_futures["youtube"].result(),
+    )
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("ID3 tags:\n%s", "\n".join([f"{a}: {pformat(b)}" for a, b in tags_list.items()]))
+
+    for tag_name, value in tags_list.items():
+        params: TagParams = {"encoding": 3}
+        if tag_name == "APIC":
+            params.update(_get_apic_tag(value))
+        else:
+            if tag_name == "COMM":
+                value = "\n\n".join(value)  # join all the comments
+            elif tag_name == "SYLT":
+                value = value[0]  # use SYLT as is (list of tuples), will be handled correctly by Mutagen
+            else:
+                value = str(value[0])  # stringify anything else
+            params["text"] = value
+        if tag_name == "COMM":
+            params["lang"] = "eng"
+        elif tag_name == "USLT":
+            params["lang"] = (tags_list.get("TLAN", []) + [""])[0] or "eng"
+        tags[tag_name] = ID3_FRAMES[tag_name](**params)
+
+    # the file is already at its final place, tag it in place
+    tags.save(filename, v2_version=3)
+    logger.info("Final filename: %s", filename)
+
+    if "USLT" in tags_list:
+        with open(filename.rsplit(".", 1)[0] + ".lrc", "wb") as f:
+            f.write((tags_list["USLT"][0] + "\n").encode("utf-8"))
+
+    return filename
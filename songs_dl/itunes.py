@@ -1,13 +1,29 @@
+import json
 import logging
-from threading import Lock
+import operator
 from typing import Any
 
 import requests
 
-from .utils import Picture, PictureProvider, Song, format_query, get, locked
+from .cache import cached_get
+from .utils import Picture, PictureProvider, Song, cached_results, format_query, get, json_loads
 
 logger = logging.getLogger(__name__)
-itunes_lock = Lock()
+
+# fields of the iTunes results that are used in the songs, with their expected types
+_FIELDS: tuple[tuple[str, type], ...] = (
+    ("trackName", str),
+    ("artistName", str),
+    ("collectionName", str),
+    ("trackTimeMillis", int),
+    ("country", str),
+    ("primaryGenreName", str),
+    ("trackNumber", int),
+    ("trackCount", int),
+    ("releaseDate", str),
+)
+# read all the fields in one go (used when they are all here with the correct types)
+_FIELDS_GETTER = operator.itemgetter(*(key for key, _ in _FIELDS))
 
 
 class ItunesPictureProvider(PictureProvider):
@@ -25,9 +41,36 @@ class ItunesPictureProvider(PictureProvider):
         return pictures
 
 
-def download_itunes(song: str, artist: str | None = None, market: str | None = None):
+def _get_fields(result: dict[str, Any]) -> tuple[Any, ...]:
     """
-    Fetch the iTunes search results.
+    Return the fields of an iTunes result that are used in the `Song`.
+    """
+    try:
+        fields = _FIELDS_GETTER(result)
+    except KeyError:
+        pass
+    else:
+        if all(isinstance(value, expected) for value, (_, expected) in zip(fields, _FIELDS)):
+            return fields
+    # some fields are missing or have an unexpected type, use the default values
+    return tuple(get(result, key, expected) for key, expected in _FIELDS)
+
+
+def is_valid_response(resp: requests.Response):
+    """
+    Check if an iTunes search response contains results (to avoid caching errors).
+    """
+    try:
+        data = json_loads(resp.content)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return False
+    return isinstance(data, dict) and "results" in data
+
+
+@cached_results()
+def search_itunes(song: str, artist: str | None = None, market: str | None = None):
+    """
+    Return the raw iTunes search results.
     """
     logger.info("Searching %s on iTunes...", format_query(song, artist, market))
     if artist:
@@ -37,12 +80,12 @@ def download_itunes(song: str, artist: str | None = None, market: str | None = N
     params = {"term": query, "entity": "song"}
     if market:
         params["country"] = market
-    req = locked(itunes_lock)(requests.get)("https://itunes.apple.com/search", params=params)
+    req = cached_get("https://itunes.apple.com/search", params=params, check=is_valid_response)
     try:
         # decode the JSON data
-        search = req.json()
+        search = json_loads(req.content)
         logger.debug("JSON decoding OK")
-    except requests.exceptions.JSONDecodeError as err:
+    except (json.JSONDecodeError, UnicodeDecodeError) as err:
         # we skip iTunes
         logger.debug("JSON decoding error: %s", err)
         return []
@@ -52,22 +95,29 @@ def download_itunes(song: str, artist: str | None = None, market: str | None = N
         logger.debug("No 'results' index")
         return []  # same thing
 
+    return results
+
+
+def download_itunes(song: str, artist: str | None = None, market: str | None = None):
+    """
+    Fetch the iTunes search results.
+    """
     ret: list[Song] = []
 
-    for result in results:
+    for result in search_itunes(song, artist, market):
+        title, result_artist, album, duration, country, genre, track_number, track_count, release_date = _get_fields(
+            result
+        )
         ret.append(
             Song(
-                title=get(result, "trackName", str),
-                artists=[get(result, "artistName", str)],
-                album=get(result, "collectionName", str),
-                duration=get(result, "trackTimeMillis", int) / 1000,
-                language=get(result, "country", str).lower(),
-                genre=get(result, "primaryGenreName", str),
-                track_number=(
-                    get(result, "trackNumber", int),
-                    get(result, "trackCount", int),
-                ),
-                release_date=get(result, "releaseDate", str),
+                title=title,
+                artists=[result_artist],
+                album=album,
+                duration=duration / 1000,
+                language=country.lower(),
+                genre=genre,
+                track_number=(track_number, track_count),
+                release_date=release_date,
                 # picture = Picture(image, taille) if image and taille else None,
                 picture=ItunesPictureProvider(result),
             )
@@ -2,21 +2,41 @@
 Monkeypatch of the requests library to add a progress bar to each request.
 """
 
+import time
+
 from requests.models import Response
 from tqdm import tqdm
 
+# minimum time between two progress bar updates (in seconds)
+UPDATE_INTERVAL = 0.1
+# number of bytes after which the progress bar is always updated
+UPDATE_SIZE = 64 * 1024
+# chunk size used when it's not specified
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
 
 def mp_requests():
     if hasattr(Response.iter_content, "monkeypatched"):
         return
 
     def iter_content(self, *args, **kwargs):
-        pb = tqdm(unit_scale=True, unit="B")
+        if not args and "chunk_size" not in kwargs:
+            # the default chunk size (1 byte) is very slow
+            kwargs["chunk_size"] = DEFAULT_CHUNK_SIZE
+        pb = tqdm(unit_scale=True, unit="B", mininterval=UPDATE_INTERVAL)
         if "Content-Length" in self.headers:
             pb.total = int(self.headers["Content-Length"])
+        # update the progress bar every UPDATE_INTERVAL seconds or UPDATE_SIZE bytes
+        pending = 0
+        last_update = time.monotonic()
         for e in Response._old_iter_content(self, *args, **kwargs):  # type: ignore
-            pb.update(len(e))
+            pending += len(e)
+            if pending >= UPDATE_SIZE or time.monotonic() - last_update >= UPDATE_INTERVAL:
+                pb.update(pending)
+                pending = 0
+                last_update = time.monotonic()
             yield e
+        pb.update(pending)
         pb.close()
 
     iter_content.monkeypatched = True
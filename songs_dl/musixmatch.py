@@ -1,18 +1,22 @@
-import datetime
 from functools import partial
 import json
 import logging
 from pprint import pformat
-from threading import Lock
-from time import sleep, time
+from threading import RLock
+from time import monotonic, sleep
 from typing import Any
 
 import requests
 
-from .utils import Picture, PictureProvider, Song, format_query, get, locked
+from .cache import cached_get
+from .utils import Picture, PictureProvider, Song, cached_results, compile_path, format_query, get, json_loads, session
 
 logger = logging.getLogger(__name__)
-musixmatch_lock = Lock()
+# lock for the access token (reentrant because `get_access_token` retries by calling itself)
+musixmatch_lock = RLock()
+
+# prefix of the album cover keys, e.g. album_coverart_350x350
+_COVER_ART_PREFIX = "album_coverart_"
 
 
 class MusixmatchPictureProvider(PictureProvider):
@@ -21,64 +25,92 @@ class MusixmatchPictureProvider(PictureProvider):
         pictures: list[Picture] = []
 
         for key, value in result.items():
-            if key.startswith("album_coverart_"):
-                try:
-                    pictures.append(Picture(value, int(key.removeprefix("album_coverart_").split("x")[0])))
-                except ValueError:  # invalid number
-                    pass
+            if not key.startswith(_COVER_ART_PREFIX):
+                continue
+            size, _, _ = key[len(_COVER_ART_PREFIX) :].partition("x")
+            try:
+                pictures.append(Picture(value, int(size)))
+            except ValueError:  # invalid number
+                pass
 
         return pictures
 
 
-ACCESS_TOKEN = ""
-ACCESS_TOKEN_EXPIRATION = 0
+# access token and its expiration time, replaced in one go
+ACCESS_TOKEN: tuple[str, float] = ("", 0)
+# time before the real expiration when the token is refreshed (in seconds)
+# so it doesn't expire during a request
+ACCESS_TOKEN_EXPIRATION_SKEW = 30
 
 
 def get_access_token(tries: int = 3):
     """Gets the Musixmatch access token."""
-    global ACCESS_TOKEN, ACCESS_TOKEN_EXPIRATION
+    global ACCESS_TOKEN
+
+    token, expiration = ACCESS_TOKEN
+    if expiration > monotonic():
+        return token
+
+    # only one thread gets the token, the other ones wait for it
+    with musixmatch_lock:
+        # another thread may have got the token while we were waiting
+        if ACCESS_TOKEN[1] <= monotonic():
+            logger.info("Getting Musixmatch access token...")
+            req = session.get("https://apic-desktop.musixmatch.com/ws/1.1/token.get", {"app_id": "web-desktop-app-v1.0", "user_language": "en"})
+            req.raise_for_status()
 
-    if not ACCESS_TOKEN_EXPIRATION or ACCESS_TOKEN_EXPIRATION < time():
-        logger.info("Getting Musixmatch access token...")
-        req = locked(musixmatch_lock)(requests.get)("https://apic-desktop.musixmatch.com/ws/1.1/token.get", {"app_id": "web-desktop-app-v1.0", "user_language": "en"})
-        req.raise_for_status()
+            try:
+                result = json_loads(req.content)
+                logger.debug("JSON decoding OK")
+            except (json.JSONDecodeError, UnicodeDecodeError) as err:
+                logger.debug("JSON decoding error: %s", err)
+                return ""
 
-        try:
-            result = req.json()
-            logger.debug("JSON decoding OK")
-        except requests.JSONDecodeError as err:
-            logger.debug("JSON decoding error: %s", err)
-            return ""
+            status_code = get(result, ("message", "header", "status_code"), int)
+            if status_code and status_code != 200:
+                logger.warning("Musixmatch API error when getting API token, waiting...")
+                sleep(5)
+                return get_access_token(tries - 1) if tries > 0 else ""
 
-        status_code = get(result, ("message", "header", "status_code"), int)
-        if status_code and status_code != 200:
-            logger.warning("Musixmatch API error when getting API token, waiting...")
-            sleep(5)
-            return get_access_token(tries - 1) if tries > 0 else ""
+            token = get(result, ("message", "body", "user_token"), str)
 
-        token = get(result, ("message", "body", "user_token"), str)
+            if not token:
+                logger.error("Can't get the Musixmatch access token!")
+                return ""
 
-        if not token:
-            logger.error("Can't get the Musixmatch access token!")
-            return ""
+            ACCESS_TOKEN = (token, monotonic() + 10 * 60 - ACCESS_TOKEN_EXPIRATION_SKEW)  # 10 minutes
 
-        ACCESS_TOKEN = token
-        ACCESS_TOKEN_EXPIRATION = int(time() + 10 * 60)  # 10 minutes
+    return ACCESS_TOKEN[0]
 
-    return ACCESS_TOKEN
 
+def is_valid_response(resp: requests.Response):
+    """Checks if a Musixmatch API response is not an error (to avoid caching errors)."""
+    try:
+        data = json_loads(resp.content)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return False
+    return get(data, ("message", "header", "status_code"), int) in (0, 200)
 
-def get_api(url, params=None, headers=None, *args, **kwargs):
-    resp = locked(musixmatch_lock)(requests.get)("https://apic-desktop.musixmatch.com/ws/1.1/" + url, {
+
+def add_access_token(request: requests.PreparedRequest):
+    """
+    Add the Musixmatch user token to a request (only when it's sent, not for the cached responses).
+    """
+    request.prepare_url(request.url, {"usertoken": get_access_token()})
+    return request
+
+
+def get_api(url, params=None, headers=None, **kwargs):
+    # the user token changes, it's not used in the cache key
+    resp = cached_get("https://apic-desktop.musixmatch.com/ws/1.1/" + url, {
         **(params or {}),
         "app_id": "web-desktop-app-v1.0",
-        "usertoken": get_access_token(),
     }, headers={
         **(headers or {}),
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/86.0.4240.183 Safari/537.36",
-    }, *args, **kwargs)
+    }, auth=add_access_token, check=is_valid_response, **kwargs)
     resp.raise_for_status()
-    data = resp.json()
+    data = json_loads(resp.content)
     status_code = get(data, ("message", "header", "status_code"), int)
     if status_code and status_code != 200:
         logger.error("Musixmatch API error")
@@ -88,9 +120,11 @@ def get_api(url, params=None, headers=None, *args, **kwargs):
 
 def format_time(time_in_seconds: float):
     """Returns a [mm:ss.xx] formatted string from the given time in seconds."""
-    time = datetime.timedelta(seconds=time_in_seconds)
-    minutes, seconds = divmod(time.seconds, 60)
-    return f"{minutes:02}:{seconds:02}.{time.microseconds//10000:02}"
+    # round to the microsecond like timedelta, then truncate to hundredths of a second
+    centiseconds = round(time_in_seconds * 1_000_000) // 10_000
+    seconds, centiseconds = divmod(centiseconds, 100)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{minutes:02}:{seconds:02}.{centiseconds:02}"
 
 
 def get_lyrics(track_id: int):
@@ -115,41 +149,57 @@ def get_lyrics(track_id: int):
     return get(data, ("message", "body", "subtitle", "subtitle_body"), str)
 
 
-def lazy_string(func):
-    class LazyString:
-        def __init__(self) -> None:
-            self._data = None
+class LazyString:
+    __slots__ = ("_func", "_data")
 
-        @property
-        def data(self):
-            if self._data is None:
-                self._data = func()
-            return self._data
+    def __init__(self, func) -> None:
+        self._func = func
+        self._data = None
 
-        def __str__(self):
-            return str(self.data)
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._func()
+        return self._data
 
-        def __repr__(self):
-            return str(self.data)
+    def __str__(self):
+        return str(self.data)
 
-        def __eq__(self, other):
-            return str(self) == other
+    def __repr__(self):
+        return str(self.data)
 
-        def __hash__(self):
-            return hash(str(self))
+    def __eq__(self, other):
+        return str(self) == other
 
-        def __len__(self):
-            return len(str(self))
+    def __hash__(self):
+        return hash(str(self))
 
-        def __add__(self, other):
-            return str(self) + other
+    def __len__(self):
+        return len(str(self))
 
-    return LazyString()
+    def __add__(self, other):
+        return str(self) + other
 
 
-def download_musixmatch(song: str, artist: str | None = None, market: str | None = None):
+def lazy_string(func):
+    return LazyString(func)
+
+
+# getters for the search results fields
+_get_track = compile_path("track", dict)
+_get_track_name = compile_path("track_name", str)
+_get_artist_name = compile_path("artist_name", str)
+_get_album_name = compile_path("album_name", str)
+_get_track_length = compile_path("track_length", int)
+_get_genre = compile_path(("primary_genres", "music_genre_list", 0, "music_genre", "music_genre_name"), str)
+_get_release_date = compile_path("first_release_date", str)
+_get_track_id = compile_path("track_id", int)
+
+
+@cached_results()
+def search_musixmatch(song: str, artist: str | None = None, market: str | None = None):
     """
-    Fetch the Musixmatch search results.
+    Return the raw Musixmatch search results.
     """
     logger.info("Searching %s on Musixmatch...", format_query(song, artist, market))
     if artist:
@@ -160,23 +210,29 @@ def download_musixmatch(song: str, artist: str | None = None, market: str | None
     data = get_api("track.search", {"q": query, "limit": 20})
     tracks = get(data, ("message", "body", "track_list"), list)
 
+    return [track for track in map(_get_track, tracks) if track]
+
+
+def download_musixmatch(song: str, artist: str | None = None, market: str | None = None):
+    """
+    Fetch the Musixmatch search results.
+    """
     ret: list[Song] = []
-    for track in tracks:
-        track = get(track, "track", dict)
-        if track:
-            ret.append(
-                Song(
-                    title=get(track, "track_name", str),
-                    artists=[get(track, "artist_name", str)],
-                    album=get(track, "album_name", str),
-                    duration=get(track, "track_length", int),
-                    genre=get(track, ("primary_genres", "music_genre_list", 0, "music_genre", "music_genre_name"), str),
-                    release_date=get(track, "first_release_date", str),
-                    lyrics=lazy_string(partial(get_lyrics, get(track, "track_id", int))),  # type: ignore
-                    picture=MusixmatchPictureProvider(track),
-                )
+    for track in search_musixmatch(song, artist, market):
+        ret.append(
+            Song(
+                title=_get_track_name(track),
+                artists=[_get_artist_name(track)],
+                album=_get_album_name(track),
+                duration=_get_track_length(track),
+                genre=_get_genre(track),
+                release_date=_get_release_date(track),
+                lyrics=lazy_string(partial(get_lyrics, _get_track_id(track))),  # type: ignore
+                picture=MusixmatchPictureProvider(track),
             )
+        )
 
-    logger.debug("Results:\n%s", pformat(ret))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Results:\n%s", pformat(ret))
 
     return ret
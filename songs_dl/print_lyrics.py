@@ -1,27 +1,47 @@
 import argparse
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from glob import glob
 from pathlib import Path
 
-from fpdf import FPDF
-from fpdf.enums import XPos, YPos
 from mutagen.id3._util import ID3NoHeaderError
 
 from songs_dl.utils import Song
 
 
+@lru_cache(maxsize=1024)
+def _load_song(file: str, _mtime_ns: int, _size: int):
+    """
+    Read the tags of a song (the modification time and the size invalidate the cache).
+    """
+    return Song.from_id3(file)
+
+
+def load_song_or_lyrics(file: str) -> Song | str:
+    """
+    Return the song in `file` or its content if it's a lyrics file.
+    """
+    try:
+        stat = os.stat(file)
+        return _load_song(os.path.abspath(file), stat.st_mtime_ns, stat.st_size)
+    except ID3NoHeaderError:
+        return Path(file).read_text()
+
+
 def print_lyrics(*songs_or_lyrics):
+    # fpdf is only needed here
+    from fpdf import FPDF
+    from fpdf.enums import XPos, YPos
+
     song_files = []
     for file in songs_or_lyrics:
         song_files.extend(glob(file))
 
-    songs = []
-    for song in song_files:
-        try:
-            songs.append(Song.from_id3(song))
-        except ID3NoHeaderError:
-            songs.append(Path(song).read_text())
+    # read the files in parallel
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        songs = list(executor.map(load_song_or_lyrics, song_files))
 
     pdf = FPDF()
     pdf.add_font("Montserrat", "", "C:/Windows/Fonts/Montserrat-Regular.ttf")
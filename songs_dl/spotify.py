@@ -1,14 +1,17 @@
+import json
 import logging
 from pprint import pformat
 from threading import Lock
-from time import time
+from time import monotonic, time
 from typing import TypedDict
 
 import requests
 
-from .utils import Picture, PictureProvider, Song, format_query, get, locked
+from .cache import cached_get
+from .utils import Picture, PictureProvider, Song, format_query, get, json_loads, session
 
 logger = logging.getLogger(__name__)
+# lock for the access token refresh
 spotify_lock = Lock()
 
 
@@ -60,24 +63,35 @@ class SpotifyData(TypedDict):
     tracks: SpotifyTracks
 
 
-ACCESS_TOKEN = ""
-ACCESS_TOKEN_EXPIRATION = 0
+# access token and its expiration time (with `time.monotonic`), replaced in one go
+ACCESS_TOKEN: tuple[str, float] = ("", 0)
+# time before the real expiration when the token is refreshed (in seconds)
+# so it doesn't expire during a request
+ACCESS_TOKEN_EXPIRATION_SKEW = 30
 
 
 def get_access_token():
     """
     Get the Spofity access token
     """
-    global ACCESS_TOKEN, ACCESS_TOKEN_EXPIRATION
-    # we don't need "global" statement (we edit the keys)
-    if not ACCESS_TOKEN_EXPIRATION or ACCESS_TOKEN_EXPIRATION < time():
+    global ACCESS_TOKEN
+    token, expiration = ACCESS_TOKEN
+    if expiration > monotonic():
+        return token
+
+    with spotify_lock:
+        # another thread may have got the token while we were waiting
+        token, expiration = ACCESS_TOKEN
+        if expiration > monotonic():
+            return token
+
         logger.info("Getting Spotify access token...")
-        req = locked(spotify_lock)(requests.get)("https://open.spotify.com/get_access_token")
+        req = session.get("https://open.spotify.com/get_access_token")
 
         try:
-            result = req.json()
+            result = json_loads(req.content)
             logger.debug("JSON decoding OK")
-        except requests.JSONDecodeError as err:
+        except (json.JSONDecodeError, UnicodeDecodeError) as err:
             logger.debug("JSON decoding error: %s", err)
             return ""
 
@@ -85,13 +99,12 @@ def get_access_token():
             logger.error("Can't get the Spotify access token!")
             return ""
 
-        ACCESS_TOKEN_EXPIRATION = get(result, "accessTokenExpirationTimestampMs", int) or int(
-            time() + 30 * 60
-        )  # 30 minutes
+        expiration_ms = get(result, "accessTokenExpirationTimestampMs", int)
+        expires_in = expiration_ms / 1000 - time() if expiration_ms else 30 * 60  # 30 minutes
 
-        ACCESS_TOKEN = result["accessToken"]
+        ACCESS_TOKEN = (result["accessToken"], monotonic() + expires_in - ACCESS_TOKEN_EXPIRATION_SKEW)
 
-    return ACCESS_TOKEN
+    return ACCESS_TOKEN[0]
 
 
 class SpotifyPictureProvider(PictureProvider):
@@ -114,15 +127,32 @@ class SpotifyPictureProvider(PictureProvider):
         return None  # the Spotify URLs are hash-based
 
 
-def download_spotify(song: str, artist: str | None = None, market: str | None = None):
+def is_valid_response(resp: requests.Response):
     """
-    Fetch the Spotify search results.
+    Check if a Spotify search response contains results (to avoid caching errors).
+    """
+    try:
+        data = json_loads(resp.content)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return False
+    return isinstance(data, dict) and "tracks" in data
+
+
+def add_access_token(request: requests.PreparedRequest):
+    """
+    Add the Spotify access token to a request (only when it's sent, not for the cached responses).
     """
     access_token = get_access_token()
     if not access_token:
-        logger.error("No access token: stop Spotify search")
-        return []
+        raise requests.RequestException("No access token", request=request)
+    request.headers["Authorization"] = f"Bearer {access_token}"
+    return request
+
 
+def download_spotify(song: str, artist: str | None = None, market: str | None = None):
+    """
+    Fetch the Spotify search results.
+    """
     logger.info("Searching %s on Spotify...", format_query(song, artist, market))
     params = {
         "q": f"{song} {artist}" if artist else song,
@@ -130,16 +160,21 @@ def download_spotify(song: str, artist: str | None = None, market: str | None =
     }
     if market:
         params["market"] = market
-    req = locked(spotify_lock)(requests.get)(
-        "https://api.spotify.com/v1/search",
-        params=params,
-        headers={"Authorization": f"Bearer {access_token}"},
-    )
+    try:
+        req = cached_get(
+            "https://api.spotify.com/v1/search",
+            params=params,
+            auth=add_access_token,
+            check=is_valid_response,
+        )
+    except requests.RequestException as err:
+        logger.error("%s: stop Spotify search", err)
+        return []
 
     try:
-        result = req.json()
+        result = json_loads(req.content)
         logger.debug("JSON decoding OK")
-    except requests.exceptions.JSONDecodeError as err:
+    except (json.JSONDecodeError, UnicodeDecodeError) as err:
         # we skip Spotify
         logger.debug("JSON decoding error: %s", err)
         return []
@@ -150,16 +185,17 @@ def download_spotify(song: str, artist: str | None = None, market: str | None =
     for element in result.get("tracks", {}).get("items", []):
         ret.append(
             Song(
-                title=get(element, "name", str),
-                artists=[get(artist, "name", str) for artist in element.get("artists", {})],
-                album=get(element.get("album", {}), "name", str),
-                duration=get(element, "duration_ms", int) / 1000,
-                isrc=get(element, ("external_ids", "isrc"), str),
+                title=element.get("name") or "",
+                artists=[artist.get("name") or "" for artist in element.get("artists") or ()],
+                album=(element.get("album") or {}).get("name") or "",
+                duration=(element.get("duration_ms") or 0) / 1000,
+                isrc=(element.get("external_ids") or {}).get("isrc") or "",
                 picture=SpotifyPictureProvider(element),
                 # TODO add other elements?
             )
         )
 
-    logger.debug("Results:\n%s", pformat(ret))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Results:\n%s", pformat(ret))
 
     return ret
@@ -5,6 +5,7 @@ Utilitary functions.
 import datetime as dt
 import functools
 import inspect
+import json
 import logging
 import re
 from io import BytesIO
@@ -27,13 +28,32 @@ from typing import (
 import mutagen.id3
 import requests
 from rapidfuzz import fuzz
+from requests.adapters import HTTPAdapter
 from unidecode import unidecode as unidecode_py
+from urllib3.util.retry import Retry
 from yt_dlp.utils import traverse_obj
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 Self = TypeVar("Self")
 
 logger = logging.getLogger(__name__)
 
+# shared session for all the providers (the connections are kept alive
+# and retried if they fail)
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.2))
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
 AnyDictKey = TypeVar("AnyDictKey")
 AnyT = TypeVar("AnyT")
 
@@ -55,21 +75,29 @@ def merge_dicts(
     ret = {}
     for arg in args:
         for key, value in arg.items():
-            if value:
-                if ret.get(key) is None:
-                    ret[key] = []
-                if merge_lists is None:
-                    if not isinstance(value, list) and not isinstance(value, tuple):
-                        value = [value]
-                elif merge_lists is False:
-                    value = [value]
-                else:
-                    if not isinstance(value, list) and not isinstance(value, tuple):
-                        raise ValueError(f"The value {key!r}: {value!r} is not a list")
-                ret[key].append(*value)
+            if not value:
+                continue
+            is_list = isinstance(value, (list, tuple))
+            if merge_lists is True and not is_list:
+                raise ValueError(f"The value {key!r}: {value!r} is not a list")
+            if merge_lists is not False and is_list:
+                ret.setdefault(key, []).extend(value)
+            else:
+                ret.setdefault(key, []).append(value)
     return ret
 
 
+def json_loads(data: bytes | str) -> Any:
+    """
+    Decode JSON data (with `orjson` if it's installed).
+
+    The errors are subclasses of `json.JSONDecodeError` in both cases.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 ExpectedT = TypeVar("ExpectedT")
 
 
@@ -170,6 +198,29 @@ def instantiate(target_type: Type[ExpectedT] | Callable[[Any], ExpectedT]) -> Ex
     return None
 
 
+def compile_path(path: Any, expected: Type[ExpectedT]) -> Callable[[Any], ExpectedT]:
+    """
+    Return a function that gets the value at `path` (a key or a tuple of keys/indexes) in an object.
+
+    It does the same thing as `get(obj, path, expected)` with a simple path and a type
+    but it's faster when used in loops.
+    """
+    keys = path if isinstance(path, tuple) else (path,)
+    expected_type = get_base_type(expected)
+
+    def getter(obj: Any) -> ExpectedT:
+        try:
+            for key in keys:
+                obj = obj[key]
+        except (KeyError, IndexError, TypeError):
+            return instantiate(expected)  # type: ignore
+        if isinstance(obj, expected_type):
+            return obj
+        return instantiate(expected)  # type: ignore
+
+    return getter
+
+
 def fuzz_wrapper(func):
     """
     Decorator for `rapidfuzz` functions: work around emojis that cause bugs.
@@ -220,13 +271,13 @@ class Picture:
     def _load_metadata(self):
         if self.data:
             self.sure = True
+            if Image is None:
+                return
             try:
-                from PIL import Image
-
                 img = Image.open(BytesIO(self.data))
                 self._pillow = img
                 self.width, self.height = img.size
-            except (ImportError, OSError):
+            except OSError:
                 pass
 
     @property
@@ -234,11 +285,9 @@ class Picture:
         if self._pillow is not None:
             return self._pillow
 
-        if not isinstance(self.data, bytes):
+        if not isinstance(self.data, bytes) or Image is None:
             return None
 
-        from PIL import Image
-
         self._pillow = Image.open(BytesIO(self.data))
         return self._pillow
 
@@ -257,7 +306,7 @@ class Picture:
             return True
         logger.debug("Checking picture '%s'...", self.url)
         # don't download the picture, just the headers
-        req = requests.head(self.url, stream=True)
+        req = session.head(self.url, stream=True)
         try:
             req.raise_for_status()
             self.sure = True
@@ -280,7 +329,7 @@ class Picture:
 
         try:
             # don't download the page if there is an error
-            self.req = requests.get(self.url, stream=True)
+            self.req = session.get(self.url, stream=True)
             self.req.raise_for_status()
             self.data = self.req.content
         except requests.exceptions.HTTPError as err:
@@ -302,10 +351,10 @@ class PictureProvider:
     pictures: list[Picture]
 
     def __init__(self, result: dict[str, Any]):
-        self.provider_urls = {pic.size: pic for pic in self.get_sure_pictures(result)}
-
         self.pictures = self.get_sure_pictures(result)
 
+        self.provider_urls = {pic.size: pic for pic in self.pictures}
+
         if not self.pictures:
             return
 
@@ -537,7 +586,12 @@ class Song:
         )
 
     @classmethod
-    def merge(cls: Type[Self], songs: list[Self]) -> Self:
+    def merge(cls: Type[Self], songs: list[Self], fields: Iterable[str] | None = None) -> Self:
+        """
+        Return a song with the first non-empty value of each field in `songs`.
+
+        If `fields` is given, only these fields are read (the other ones are left empty).
+        """
         T = TypeVar("T")
         T2 = TypeVar("T2")
 
@@ -553,6 +607,8 @@ class Song:
 
         kwargs = {}
         for arg, def_value in (inspect.getfullargspec(cls.__init__).kwonlydefaults or {}).items():
+            if fields is not None and arg not in fields:
+                continue
             kwargs[arg] = get_first((getattr(song, arg) for song in songs), def_value)
 
         return cls(**kwargs)  # type: ignore
@@ -561,18 +617,38 @@ class Song:
         return f"<Song '{self.title}' by {', '.join(self.artists)} album {self.album} {self.duration} s>"
 
 
+_WORD_RE = re.compile(r"\w+")
+_NORMALIZE_RE = re.compile(r"(?i)\(.*?\)|-\s+.*|feat")
+_ABBREVIATION_DOT_RE = re.compile(r"\.\s*(?=\w\W|\w$|$)")
+_SAINT_RE = re.compile(r"\bst(e?s?)(\s+|$)")
+_OFFICIAL_RE = re.compile(r"(?i)(\b[ou]ffi[cz]i[ae]l|_off\b|\btopic\b|audio(?=.*\b[ou]ffi[cz]i[ae]l))")
+_AUDIO_RE = re.compile(r"(?i)\baudio\b")
+_DISCARD_RE = re.compile(r"""(?xi)
+    \d+ h(?:our)\b
+    |\b8d audio\b
+    |\bspee?d up\b
+    |\baco?usti
+    |\blive\b
+    |\bdire[ct]ta?\b
+    |\bremix
+    |\bversion
+    |\brecord
+    |\d+[./-]\d+[./-]\d+
+    """)
+
+
 def _get_sentence_words(string: str):
     """
     Get all the words in a sentence.
     """
-    return re.findall(r"\w+", unidecode(string.lower()))
+    return _WORD_RE.findall(unidecode(string.lower()))
 
 
 def _normalize_sentence(string: str):
     """
     Return a sentence without punctuation, without brackets and lowercased.
     """
-    return " ".join(_get_sentence_words(re.sub(r"(?i)\(.*?\)|-\s+.*|feat", "", string)))
+    return " ".join(_get_sentence_words(_NORMALIZE_RE.sub("", string)))
 
 
 def get_provider_name(provider: str):
@@ -582,6 +658,10 @@ def get_provider_name(provider: str):
     return {"itunes": "iTunes", "youtube": "YouTube"}.get(provider, provider.title())
 
 
+# fields of the songs that are used by `order_results`
+RANKING_FIELDS = ("title", "artists", "duration", "copyright")
+
+
 def order_results(provider: str, best_items: list[Song], results: dict[str, list[Song]] | None):
     """
     Order the results: choose the result that is the most similar to the Spotify / Deezer song.
@@ -589,13 +669,15 @@ def order_results(provider: str, best_items: list[Song], results: dict[str, list
     if not results:
         return best_items
 
-    best_item = Song.merge(best_items)
+    # only read the fields used for ranking
+    # (the other ones may need a request, e.g. the Musixmatch lyrics)
+    best_item = Song.merge(best_items, RANKING_FIELDS)
 
     ret: list[tuple[Song, float, list[float]]] = []
 
     def normalize_title(title: str):
-        title = re.sub(r"\.\s*(?=\w\W|\w$|$)", "", title)
-        title = re.sub(r"\bst(e?s?)(\s+|$)", r"saint\1\2", title)
+        title = _ABBREVIATION_DOT_RE.sub("", title)
+        title = _SAINT_RE.sub(r"saint\1\2", title)
         return title
 
     for result in results[provider]:
@@ -631,21 +713,13 @@ def order_results(provider: str, best_items: list[Song], results: dict[str, list
             60,
         )
 
-        official_match = (
-            len(
-                re.findall(
-                    r"(?i)(\b[ou]ffi[cz]i[ae]l|_off\b|\btopic\b|audio(?=.*\b[ou]ffi[cz]i[ae]l))",
-                    song_title + " " + all_r_artists,
-                )
-            )
-            * 100
-        )
+        official_match = len(_OFFICIAL_RE.findall(song_title + " " + all_r_artists)) * 100
         if not official_match and hasattr(result, "youtube_video"):
             official_match += (
                 100 if "BADGE_STYLE_TYPE_VERIFIED_ARTIST" in result.youtube_video["badges"] else 0  # type: ignore
             )
         if official_match:
-            official_match += len(re.findall(r"(?i)\baudio\b", song_title)) * 100
+            official_match += len(_AUDIO_RE.findall(song_title)) * 100
 
         if best_item.copyright:
             copyright_match = 80 + (_normalize_sentence(best_item.copyright) in all_r_artists) * 20
@@ -657,26 +731,7 @@ def order_results(provider: str, best_items: list[Song], results: dict[str, list
 
         time_match = max(100 - non_match_value, 0)
 
-        discard_match = (
-            len(
-                re.findall(
-                    r"""(?xi)
-                    \d+ h(?:our)\b
-                    |\b8d audio\b
-                    |\bspee?d up\b
-                    |\baco?usti
-                    |\blive\b
-                    |\bdire[ct]ta?\b
-                    |\bremix
-                    |\bversion
-                    |\brecord
-                    |\d+[./-]\d+[./-]\d+
-                    """,
-                    song_title,
-                )
-            )
-            * -100
-        )
+        discard_match = len(_DISCARD_RE.findall(song_title)) * -100
 
         # the average match is rounded for debugging
         average_match = round(
@@ -735,6 +790,27 @@ def locked(lock: Lock):
     return decorator
 
 
+def cached_results(maxsize: int = 256):
+    """
+    Cache the results of a search function (the callers get a new list each time).
+
+    Only cache raw data: the songs and the pictures are modified when they are used,
+    so new ones must be created for each download.
+    """
+
+    def decorator(f: AnyFunction) -> AnyFunction:
+        cached = functools.lru_cache(maxsize)(lambda *args, **kwargs: tuple(f(*args, **kwargs)))
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            return list(cached(*args, **kwargs))
+
+        wrapper.cache_clear = cached.cache_clear  # type: ignore
+        return wrapper  # type: ignore
+
+    return decorator
+
+
 def format_query(song: str, artist: str | None = None, market: str | None = None):
     """
     Return a formatted version of `song`, `artist` and `market` (for logging).
@@ -8,6 +8,7 @@ from typing import Any, TypedDict
 
 import requests
 
+from .cache import cached_get
 from .utils import Song, format_query, get, locked
 
 youtube_lock = Lock()
@@ -76,6 +77,13 @@ class YoutubeSong(Song):
         super().__init__(*args, **kwargs)
 
 
+def is_valid_response(resp: requests.Response):
+    """
+    Check if a YouTube search page contains the results (to avoid caching consent or error pages).
+    """
+    return b"var ytInitialData = " in resp.content
+
+
 def download_youtube(song: str, artist: str | None = None, _market: str | None = None):
     """
     Get the YouTube search results.
@@ -86,7 +94,9 @@ def download_youtube(song: str, artist: str | None = None, _market: str | None =
     else:
         query = song
     song = f"allintitle:{song}"
-    req = locked(youtube_lock)(requests.get)("https://www.youtube.com/results", params={"search_query": query})
+    req = locked(youtube_lock)(cached_get)(
+        "https://www.youtube.com/results", params={"search_query": query}, check=is_valid_response
+    )
     logger.debug("Page size: %d", len(req.text))
     if not (match := re.search(r"var ytInitialData = (.*?);</script>", req.text)):
         # no YouTube video = no song => stop
@@ -199,6 +209,7 @@ def download_youtube(song: str, artist: str | None = None, _market: str | None =
 
     ret = [map_video(v) for v in videos_list]
 
-    logger.debug("Results:\n%s", pformat(ret))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Results:\n%s", pformat(ret))
 
     return ret
@@ -8,11 +8,16 @@ from .youtube import youtube_lock
 
 logger = logging.getLogger(__name__)
 
+# output templates with the title and the artist of the returned `Song`
+TITLE_TEMPLATE = "%(title)s"
+ARTIST_TEMPLATE = "%(uploader,channel,uploader_id,channel_id)s"
+
 
 @locked(youtube_lock)
-def download_youtube_dl(url: str):
+def download_youtube_dl(url: str, outtmpl: str | None = None):
     """
     Download a video with `yt_dlp`.
+    `outtmpl` is the output template (the video title by default).
     """
     filename = ""
     info_dict = {}
@@ -30,7 +35,7 @@ def download_youtube_dl(url: str):
     # name = f"{int(str(random.random())[2:]):x}"
     with YoutubeDL(
         {
-            "outtmpl": "%(title)s.%(ext)s",
+            "outtmpl": outtmpl or TITLE_TEMPLATE + ".%(ext)s",
             "format": "bestaudio",
             "retries": float("inf"),
             "postprocessors": [